@@ -1,14 +1,18 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, send_file, abort
+from flask import Flask, render_template, request, jsonify, redirect, url_for, send_file, abort, g
 from datetime import datetime, timedelta
 import sqlite3
 import os
 import base64
-import json
+import orjson
 import shutil
 import re
 from dotenv import load_dotenv
+from PIL import Image
 import threading
 import time
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
 # Cargar variables de entorno desde archivo .env
 load_dotenv()
@@ -26,9 +30,200 @@ else:
 
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
+# Delegar el envío de fotos al proxy inverso (nginx/Apache) mediante X-Sendfile.
+# Solo debe activarse cuando la aplicación corre detrás de un proxy que lo soporte.
+app.config['USE_X_SENDFILE'] = os.getenv('USE_X_SENDFILE', '').lower() in ('1', 'true', 'yes')
+
 # Crear directorio de uploads si no existe
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+# Carpeta opcional con una copia de la miniatura principal de cada registro, nombrada
+# <tipo>/<id>.jpg, para que el proxy inverso (nginx) la sirva directamente en /fotos/
+app.config['FOTOS_PUBLICAS_FOLDER'] = os.getenv('FOTOS_PUBLICAS_FOLDER')
+if app.config['FOTOS_PUBLICAS_FOLDER']:
+    for tipo_registro in ('residente', 'visita'):
+        os.makedirs(os.path.join(app.config['FOTOS_PUBLICAS_FOLDER'], tipo_registro), exist_ok=True)
+
+# Carpeta de las miniaturas usadas en el listado, nombradas <tipo>/<id>.jpg y <tipo>/<id>.webp.
+# Va fuera de UPLOAD_FOLDER para no agregar archivos a la base de rostros del reconocimiento
+# facial (las rutas relativas se resuelven desde la raíz del proyecto, igual que en send_file)
+app.config['MINIATURAS_FOLDER'] = os.path.join(app.root_path, os.getenv('MINIATURAS_FOLDER', 'miniaturas'))
+for tipo_registro in ('residente', 'visita'):
+    os.makedirs(os.path.join(app.config['MINIATURAS_FOLDER'], tipo_registro), exist_ok=True)
+
+# Ruta de la base de datos SQLite
+DB_PATH = 'registro.db'
+
+# Sentencias SQL usadas por las rutas. Se definen una sola vez para que el
+# caché de sentencias preparadas de cada conexión las reutilice.
+SQL_SELECT_CARPETA_RESIDENTE = 'SELECT carpeta_path FROM residentes WHERE id = ?'
+SQL_SELECT_CARPETA_VISITA = 'SELECT carpeta_path FROM visitas WHERE id = ?'
+SQL_SELECT_FOTO_RESIDENTE = 'SELECT foto_path FROM residentes WHERE id = ?'
+SQL_SELECT_FOTO_VISITA = 'SELECT foto_path FROM visitas WHERE id = ?'
+SQL_SELECT_RETOMAR_RESIDENTE = 'SELECT nombre, rut, carpeta_path FROM residentes WHERE id = ?'
+SQL_SELECT_RETOMAR_VISITA = 'SELECT nombre, rut, fecha_expiracion, carpeta_path FROM visitas WHERE id = ?'
+SQL_LISTAR_RESIDENTES = '''SELECT id, nombre, rut, foto_path, carpeta_path, fecha_registro 
+                           FROM residentes ORDER BY fecha_registro DESC'''
+# fecha_expiracion se guarda en hora local, por lo que se compara contra
+# datetime('now', 'localtime') y no contra CURRENT_TIMESTAMP (UTC)
+SQL_AHORA_LOCAL = "SELECT datetime('now', 'localtime')"
+SQL_LISTAR_VISITAS = '''SELECT id, nombre, rut, foto_path, carpeta_path, fecha_registro, fecha_expiracion 
+                        FROM visitas WHERE fecha_expiracion > datetime('now', 'localtime')
+                        ORDER BY fecha_registro DESC'''
+SQL_SELECT_VISITAS_EXPIRADAS = 'SELECT id, carpeta_path FROM visitas WHERE fecha_expiracion < ?'
+SQL_DELETE_VISITAS_EXPIRADAS = 'DELETE FROM visitas WHERE fecha_expiracion < ?'
+SQL_DELETE_VISITAS_EXPIRADAS_RETURNING = '''DELETE FROM visitas WHERE fecha_expiracion < datetime('now', 'localtime')
+                                            RETURNING id, carpeta_path'''
+SQL_INSERT_RESIDENTE = '''INSERT INTO residentes (nombre, rut, foto_path, carpeta_path)
+                          VALUES (?, ?, ?, ?)'''
+SQL_UPDATE_FOTO_RESIDENTE = 'UPDATE residentes SET foto_path = ? WHERE id = ?'
+SQL_INSERT_VISITA = '''INSERT INTO visitas (nombre, rut, foto_path, carpeta_path, fecha_expiracion)
+                       VALUES (?, ?, ?, ?, ?)'''
+SQL_UPDATE_FOTO_VISITA = 'UPDATE visitas SET foto_path = ?, fecha_expiracion = ? WHERE id = ?'
+SQL_DELETE_RESIDENTE = 'DELETE FROM residentes WHERE id = ?'
+SQL_DELETE_VISITA = 'DELETE FROM visitas WHERE id = ?'
+
+# DELETE ... RETURNING solo está disponible desde SQLite 3.35
+SQLITE_SOPORTA_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+# Largo máximo (en caracteres) de cada foto en base64 recibida por JSON (~3 MB de JPEG)
+MAX_FOTO_BASE64 = 4 * 1024 * 1024
+
+# Cantidad de caracteres base64 que se leen y decodifican en cada bloque
+TAMANO_BLOQUE_BASE64 = 64 * 1024
+
+# Tamaño máximo (ancho, alto) de las miniaturas usadas en el listado
+TAMANO_MINIATURA = (200, 200)
+
+# Expresiones regulares usadas por limpiar_nombre_carpeta (compiladas una sola vez)
+_RE_CARACTERES_ESPECIALES = re.compile(r'[^\w\s-]')
+_RE_SEPARADORES = re.compile(r'[-\s]+')
+
+# Caracteres fuera del alfabeto base64 (saltos de línea, espacios, etc.), que b64decode ignora
+_RE_NO_BASE64 = re.compile(r'[^A-Za-z0-9+/=]')
+
+# Hilos para decodificar y escribir en paralelo las fotos de un registro
+_fotos_pool = ThreadPoolExecutor(max_workers=4)
+
+# Hilos para eliminar en segundo plano las carpetas de visitas expiradas
+_cleanup_pool = ThreadPoolExecutor(max_workers=2)
+
+# Conexiones de solo lectura libres para reutilizar entre requests. No se asocian
+# al hilo porque app.run() crea un hilo nuevo por request. En modo WAL los lectores
+# no bloquean al escritor ni entre ellos.
+MAX_CONEXIONES_LECTURA = 8
+_db_lectura_pool = queue.LifoQueue(maxsize=MAX_CONEXIONES_LECTURA)
+
+# Única conexión de escritura, compartida entre hilos y protegida por un lock
+_db_escritura = None
+_db_escritura_lock = threading.Lock()
+
+def _configurar_conexion(conn):
+    """
+    Aplica la configuración común a las conexiones de lectura y de escritura.
+    
+    Args:
+        conn (sqlite3.Connection): Conexión recién abierta
+    """
+    # Filas accesibles por nombre de columna (y también por índice)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.execute('PRAGMA cache_size=-20000')
+    conn.execute('PRAGMA busy_timeout=5000')
+    conn.execute('PRAGMA foreign_keys=ON')
+    # Lectura de la base de datos mediante mmap (hasta 256 MB)
+    conn.execute('PRAGMA mmap_size=268435456')
+
+def get_db():
+    """
+    Obtiene la conexión SQLite de solo lectura del request actual.
+    
+    La conexión se toma del pool de conexiones libres (o se abre una nueva si
+    está vacío) y se devuelve al pool al terminar el request, de modo que los
+    requests siguientes no pagan el costo de abrirla y configurarla, aunque
+    cada uno corra en un hilo distinto. Se abre en modo solo lectura (mode=ro),
+    por lo que las rutas de consulta nunca compiten por el lock de escritura;
+    para modificar la base de datos se usa get_db_escritura().
+    
+    Returns:
+        sqlite3.Connection: Conexión de solo lectura para el request actual
+    """
+    conn = g.get('db')
+    if conn is None:
+        try:
+            conn = _db_lectura_pool.get_nowait()
+        except queue.Empty:
+            # check_same_thread=False: la conexión se reutiliza desde otros hilos,
+            # pero nunca por dos requests a la vez
+            conn = sqlite3.connect(f'file:{DB_PATH}?mode=ro', uri=True, cached_statements=128,
+                                   check_same_thread=False)
+            _configurar_conexion(conn)
+        g.db = conn
+    return conn
+
+@app.teardown_appcontext
+def devolver_db(exception):
+    """
+    Devuelve al pool la conexión de lectura usada en el request.
+    
+    Si el pool ya tiene MAX_CONEXIONES_LECTURA conexiones libres, la conexión
+    se cierra.
+    
+    Args:
+        exception (Exception): Excepción que terminó el request, si la hubo
+    """
+    conn = g.pop('db', None)
+    if conn is None:
+        return
+    try:
+        _db_lectura_pool.put_nowait(conn)
+    except queue.Full:
+        conn.close()
+
+@contextmanager
+def get_db_escritura():
+    """
+    Abre una transacción IMMEDIATE en la conexión de escritura, con su lock tomado.
+    
+    Hay una sola conexión de escritura por proceso; el lock garantiza que
+    solo un hilo la use a la vez (SQLite admite un único escritor). Al
+    abrirla se configuran los PRAGMAs de escritura (modo WAL,
+    synchronous=NORMAL, checkpoints del WAL y tamaño máximo del WAL).
+    
+    El lock se toma solo mientras dura la transacción: al salir del bloque
+    se confirma (o se revierte si ocurre un error) y se libera el lock. Por
+    eso el bloque debe contener solo las sentencias SQL; la escritura de
+    archivos y cualquier otra E/S se hace antes o después, fuera del bloque,
+    para no serializar los registros del resto de los hilos.
+    
+    Uso:
+        with get_db_escritura() as conn:
+            conn.execute(...)
+    
+    Yields:
+        sqlite3.Connection: Conexión de escritura, dentro de la transacción
+    """
+    global _db_escritura
+    with _db_escritura_lock:
+        if _db_escritura is None:
+            conn = sqlite3.connect(DB_PATH, cached_statements=128, check_same_thread=False)
+            _configurar_conexion(conn)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            # Checkpoints del WAL menos frecuentes y tamaño del WAL acotado (64 MB)
+            conn.execute('PRAGMA wal_autocheckpoint=10000')
+            conn.execute('PRAGMA journal_size_limit=67108864')
+            _db_escritura = conn
+        conn = _db_escritura
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+
 def limpiar_nombre_carpeta(nombre):
     """
     Limpia el nombre de una carpeta eliminando caracteres especiales.
@@ -48,12 +243,249 @@ def limpiar_nombre_carpeta(nombre):
         "María-González" -> "Maria_Gonzalez"
     """
     # Eliminar todos los caracteres que no sean letras, números, espacios o guiones
-    nombre_limpio = re.sub(r'[^\w\s-]', '', nombre)
+    nombre_limpio = _RE_CARACTERES_ESPECIALES.sub('', nombre)
     # Reemplazar espacios y guiones múltiples por un solo guión bajo
-    nombre_limpio = re.sub(r'[-\s]+', '_', nombre_limpio)
+    nombre_limpio = _RE_SEPARADORES.sub('_', nombre_limpio)
     # Eliminar guiones bajos al inicio y final
     return nombre_limpio.strip('_')
 
+def guardar_foto_base64(foto_base64, foto_path):
+    """
+    Decodifica una foto en formato data URL base64 y la guarda en disco.
+    
+    El contenido se decodifica en bloques de TAMANO_BLOQUE_BASE64 caracteres
+    y cada bloque se escribe de inmediato en el archivo. Así la memoria usada
+    depende del tamaño del bloque y no del tamaño de la foto.
+    
+    Los clientes antiguos pueden enviar el base64 con saltos de línea, por lo
+    que de cada bloque se quitan los caracteres fuera del alfabeto y solo se
+    decodifica la parte múltiplo de 4; el resto pasa al bloque siguiente. Si
+    el contenido no es base64 válido se elimina el archivo a medio escribir.
+    
+    Args:
+        foto_base64 (str): Foto en formato 'data:image/jpeg;base64,<datos>'
+        foto_path (str): Ruta del archivo JPG de destino
+    """
+    # Posición donde empiezan los datos (después del prefijo data:image/jpeg;base64,)
+    inicio = foto_base64.find(',') + 1
+    resto = ''
+    try:
+        with open(foto_path, 'wb') as f:
+            for pos in range(inicio, len(foto_base64), TAMANO_BLOQUE_BASE64):
+                bloque = resto + _RE_NO_BASE64.sub('', foto_base64[pos:pos + TAMANO_BLOQUE_BASE64])
+                corte = len(bloque) - len(bloque) % 4
+                f.write(base64.b64decode(bloque[:corte]))
+                resto = bloque[corte:]
+            if resto:
+                # Un largo final que no es múltiplo de 4 produce el mismo error que
+                # decodificar el contenido completo de una vez
+                f.write(base64.b64decode(resto))
+    except Exception:
+        try:
+            os.remove(foto_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+def guardar_foto(foto, foto_path):
+    """
+    Guarda una foto recibida como archivo subido o como data URL base64.
+    
+    Args:
+        foto (FileStorage | str): Archivo JPEG subido (multipart/form-data)
+                                  o foto en formato data URL base64 (JSON)
+        foto_path (str): Ruta del archivo JPG de destino
+    """
+    if isinstance(foto, str):
+        guardar_foto_base64(foto, foto_path)
+    else:
+        # Los bytes JPEG se copian tal cual, sin decodificación
+        foto.save(foto_path)
+
+def guardar_fotos(fotos, carpeta_persona):
+    """
+    Guarda todas las fotos de un registro dentro de su carpeta.
+    
+    Las fotos se escriben en paralelo usando un pool de hilos, de modo que
+    las N escrituras a disco se superponen en lugar de hacerse una tras otra.
+    Los archivos se nombran foto_01.jpg, foto_02.jpg, etc.
+    
+    Args:
+        fotos (list): Lista de fotos (archivos subidos o data URLs base64)
+        carpeta_persona (str): Carpeta donde se guardarán las fotos
+        
+    Returns:
+        list: Rutas de las fotos guardadas, en el mismo orden recibido
+    """
+    foto_paths = [os.path.join(carpeta_persona, f"foto_{i+1:02d}.jpg")
+                  for i in range(len(fotos))]
+    # list() espera a que terminen todas las escrituras y propaga cualquier error
+    list(_fotos_pool.map(guardar_foto, fotos, foto_paths))
+    return foto_paths
+
+def ruta_miniatura(tipo, registro_id):
+    """
+    Retorna la ruta de la miniatura de la foto principal de un registro.
+    
+    Args:
+        tipo (str): Tipo de registro ('residente' o 'visita')
+        registro_id (int): ID del registro
+        
+    Returns:
+        str: Ruta <MINIATURAS_FOLDER>/<tipo>/<id>.jpg
+    """
+    return os.path.join(app.config['MINIATURAS_FOLDER'], tipo, f"{int(registro_id)}.jpg")
+
+def ruta_miniatura_webp(tipo, registro_id):
+    """
+    Retorna la ruta de la miniatura WebP de la foto principal de un registro.
+    
+    Args:
+        tipo (str): Tipo de registro ('residente' o 'visita')
+        registro_id (int): ID del registro
+        
+    Returns:
+        str: Ruta <MINIATURAS_FOLDER>/<tipo>/<id>.webp
+    """
+    return os.path.join(app.config['MINIATURAS_FOLDER'], tipo, f"{int(registro_id)}.webp")
+
+def generar_miniatura(tipo, registro_id, foto_path):
+    """
+    Genera las miniaturas JPEG y WebP de la foto principal de un registro.
+    
+    El listado muestra las fotos en tamaño pequeño, por lo que servir la
+    miniatura en lugar de la foto original reduce mucho los bytes transferidos.
+    La versión WebP se codifica una sola vez aquí y se entrega a los navegadores
+    que la aceptan, ya que pesa menos que el JPEG equivalente.
+    Si la miniatura no se puede generar se registra el error y el listado
+    sigue usando la foto original; si solo falla la versión WebP (por ejemplo,
+    con un Pillow sin soporte de WebP) se sigue usando la miniatura JPEG.
+    
+    Args:
+        tipo (str): Tipo de registro ('residente' o 'visita')
+        registro_id (int): ID del registro
+        foto_path (str): Ruta de la foto principal (foto_01.jpg)
+    """
+    try:
+        with Image.open(foto_path) as imagen:
+            if imagen.mode not in ('RGB', 'L'):
+                imagen = imagen.convert('RGB')
+            imagen.thumbnail(TAMANO_MINIATURA)
+            imagen.save(ruta_miniatura(tipo, registro_id), 'JPEG', quality=80, optimize=True)
+            try:
+                imagen.save(ruta_miniatura_webp(tipo, registro_id), 'WEBP', quality=80, method=6)
+            except Exception as e:
+                print(f"Error al generar miniatura WebP de {foto_path}: {e}")
+                # Quitar solo la WebP; servir_foto usa la miniatura JPEG si no existe
+                try:
+                    os.remove(ruta_miniatura_webp(tipo, registro_id))
+                except FileNotFoundError:
+                    pass
+    except Exception as e:
+        print(f"Error al generar miniatura de {foto_path}: {e}")
+        # No dejar una miniatura anterior o a medio escribir en lugar de la foto original
+        eliminar_miniatura(tipo, registro_id)
+
+def eliminar_miniatura(tipo, registro_id):
+    """
+    Elimina las miniaturas JPEG y WebP de la foto principal de un registro, si existen.
+    
+    Args:
+        tipo (str): Tipo de registro ('residente' o 'visita')
+        registro_id (int): ID del registro
+    """
+    for ruta in (ruta_miniatura(tipo, registro_id), ruta_miniatura_webp(tipo, registro_id)):
+        try:
+            os.remove(ruta)
+        except FileNotFoundError:
+            pass
+
+def acepta_webp():
+    """
+    Indica si el cliente declara soporte explícito de WebP en la cabecera Accept.
+    
+    No basta con que acepte */* o image/*: los navegadores sin soporte de WebP
+    también envían esos comodines.
+    
+    Returns:
+        bool: True si la cabecera Accept incluye image/webp
+    """
+    return any(valor == 'image/webp' and calidad > 0
+               for valor, calidad in request.accept_mimetypes)
+
+def ruta_foto_publica(tipo, registro_id):
+    """
+    Retorna la ruta de la copia pública de la foto principal de un registro.
+    
+    Args:
+        tipo (str): Tipo de registro ('residente' o 'visita')
+        registro_id (int): ID del registro
+        
+    Returns:
+        str: Ruta <FOTOS_PUBLICAS_FOLDER>/<tipo>/<id>.jpg
+    """
+    return os.path.join(app.config['FOTOS_PUBLICAS_FOLDER'], tipo, f"{int(registro_id)}.jpg")
+
+def publicar_foto(tipo, registro_id, foto_path):
+    """
+    Publica la foto principal de un registro en FOTOS_PUBLICAS_FOLDER.
+    
+    Crea un enlace duro (o una copia si no es posible) con un nombre estable
+    para que el proxy inverso la sirva con sendfile, sin pasar por Flask ni
+    por la base de datos. Se publica la miniatura si existe, ya que estas
+    URLs solo se usan en el listado. No hace nada si FOTOS_PUBLICAS_FOLDER
+    no está configurada.
+    
+    Args:
+        tipo (str): Tipo de registro ('residente' o 'visita')
+        registro_id (int): ID del registro
+        foto_path (str): Ruta de la foto principal (foto_01.jpg)
+    """
+    if not app.config['FOTOS_PUBLICAS_FOLDER']:
+        return
+    eliminar_foto_publica(tipo, registro_id)
+    destino = ruta_foto_publica(tipo, registro_id)
+    if os.path.exists(ruta_miniatura(tipo, registro_id)):
+        foto_path = ruta_miniatura(tipo, registro_id)
+    try:
+        os.link(foto_path, destino)
+    except OSError:
+        # Distinto sistema de archivos o sin soporte de enlaces duros
+        shutil.copyfile(foto_path, destino)
+
+def eliminar_foto_publica(tipo, registro_id):
+    """
+    Elimina la copia pública de la foto principal de un registro, si existe.
+    
+    Args:
+        tipo (str): Tipo de registro ('residente' o 'visita')
+        registro_id (int): ID del registro
+    """
+    if not app.config['FOTOS_PUBLICAS_FOLDER']:
+        return
+    try:
+        os.remove(ruta_foto_publica(tipo, registro_id))
+    except FileNotFoundError:
+        pass
+
+def obtener_datos_registro():
+    """
+    Obtiene los campos y las fotos enviados a las rutas de registro.
+    
+    El formulario de captura envía las fotos como archivos JPEG en un
+    multipart/form-data (campo 'fotos'), evitando el 33% extra del base64 y
+    su decodificación. Se mantiene el formato JSON con fotos en base64 para
+    clientes anteriores.
+    
+    Returns:
+        tuple: (datos, fotos) donde datos permite .get() de los campos del
+               registro y fotos es la lista de fotos recibidas
+    """
+    if request.is_json:
+        data = orjson.loads(request.get_data())
+        return data, data.get('fotos', [])
+    return request.form, request.files.getlist('fotos')
+
 def init_db():
     """
     Inicializa la base de datos SQLite creando las tablas necesarias.
@@ -68,7 +500,9 @@ def init_db():
     
     No retorna ningún valor, solo crea/modifica la estructura de la base de datos.
     """
-    conn = sqlite3.connect('registro.db')
+    conn = sqlite3.connect(DB_PATH)
+    # Activar modo WAL (persistente en el archivo de la base de datos)
+    conn.execute('PRAGMA journal_mode=WAL')
     c = conn.cursor()
     
     # Crear tabla de residentes con sus campos principales
@@ -101,40 +535,67 @@ def init_db():
     except sqlite3.OperationalError:
         pass  # La columna ya existe, no hacer nada
 
+    # Índices para los filtros y ordenamientos usados en el listado y la limpieza
+    # (el UNIQUE de residentes.rut ya genera su propio índice)
+    c.execute('CREATE INDEX IF NOT EXISTS idx_visitas_expiracion ON visitas(fecha_expiracion)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_visitas_fecha_registro ON visitas(fecha_registro DESC)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_residentes_fecha ON residentes(fecha_registro DESC)')
+
+    conn.commit()
+    conn.close()
+
+
+def eliminar_carpeta(carpeta_path):
+    """
+    Elimina una carpeta completa del sistema de archivos, registrando errores.
+    
+    Args:
+        carpeta_path (str): Ruta de la carpeta a eliminar
+    """
+    try:
+        if carpeta_path and os.path.exists(carpeta_path):
+            shutil.rmtree(carpeta_path)
+    except Exception as e:
+        # Registrar error pero continuar con otras carpetas
+        print(f"Error al eliminar carpeta {carpeta_path}: {e}")
 
-def cleanup_expired_visits(now=None):
+def cleanup_expired_visits():
     """
     Limpia visitas expiradas: elimina carpetas del filesystem y registros en DB.
 
-    Args:
-        now (datetime, optional): Fecha/hora de referencia. Si es None usa datetime.now().
+    Los registros se eliminan de la base de datos de inmediato; el borrado de
+    las carpetas se encola en un pool de hilos en segundo plano, por lo que
+    la función retorna sin esperar a que termine la limpieza del disco.
+
+    La fecha de referencia la entrega el propio SQLite, sin pasarla desde Python.
 
     Returns:
         int: número de visitas eliminadas
     """
-    referencia = now or datetime.now()
-    conn = sqlite3.connect('registro.db')
-    c = conn.cursor()
+    with get_db_escritura() as conn:
+        c = conn.cursor()
+        if SQLITE_SOPORTA_RETURNING:
+            # Eliminar las visitas expiradas y obtener sus carpetas en una sola sentencia
+            c.execute(SQL_DELETE_VISITAS_EXPIRADAS_RETURNING)
+            carpetas_expiradas = c.fetchall()
+            eliminadas_count = len(carpetas_expiradas)
+        else:
+            # Fijar una sola referencia para que SELECT y DELETE vean las mismas visitas
+            referencia = c.execute(SQL_AHORA_LOCAL).fetchone()[0]
 
-    # Obtener todas las visitas expiradas con sus rutas de carpeta
-    c.execute('''SELECT carpeta_path FROM visitas WHERE fecha_expiracion < ?''', (referencia,))
-    carpetas_expiradas = c.fetchall()
+            # Obtener todas las visitas expiradas con sus rutas de carpeta
+            c.execute(SQL_SELECT_VISITAS_EXPIRADAS, (referencia,))
+            carpetas_expiradas = c.fetchall()
 
-    eliminadas_count = 0
-    # Eliminar carpetas completas del sistema de archivos
-    for (carpeta_path,) in carpetas_expiradas:
-        try:
-            if carpeta_path and os.path.exists(carpeta_path):
-                shutil.rmtree(carpeta_path)
-        except Exception as e:
-            # Registrar error pero continuar con otras carpetas
-            print(f"Error al eliminar carpeta {carpeta_path}: {e}")
+            # Eliminar registros de visitas expiradas de la base de datos
+            c.execute(SQL_DELETE_VISITAS_EXPIRADAS, (referencia,))
+            eliminadas_count = c.rowcount
 
-    # Eliminar registros de visitas expiradas de la base de datos
-    c.execute('''DELETE FROM visitas WHERE fecha_expiracion < ?''', (referencia,))
-    eliminadas_count = c.rowcount
-    conn.commit()
-    conn.close()
+    # Eliminar carpetas completas del sistema de archivos en segundo plano
+    for visita_id, carpeta_path in carpetas_expiradas:
+        eliminar_foto_publica('visita', visita_id)
+        eliminar_miniatura('visita', visita_id)
+        _cleanup_pool.submit(eliminar_carpeta, carpeta_path)
 
     return eliminadas_count
 
@@ -199,10 +660,10 @@ def registrar_residente():
     4. Crea un archivo datos.json con la información del residente
     5. Guarda o actualiza el registro en la base de datos
     
-    Body JSON esperado:
+    Body esperado (multipart/form-data, o JSON con fotos en base64):
         nombre (str): Nombre del residente
         rut (str): RUT del residente (sin puntos ni guión)
-        fotos (list): Lista de fotos en formato base64
+        fotos (list): Archivos JPEG (multipart) o lista de fotos en base64 (JSON)
         registro_id (str, opcional): ID del registro si se está actualizando
         
     Returns:
@@ -215,10 +676,9 @@ def registrar_residente():
         500: Error del servidor
     """
     try:
-        data = request.json
+        data, fotos = obtener_datos_registro()
         nombre = data.get('nombre')
         rut = data.get('rut')
-        fotos_base64 = data.get('fotos', [])
         registro_id = data.get('registro_id')
         
         # Validar que se proporcionen los datos requeridos
@@ -226,21 +686,22 @@ def registrar_residente():
             return jsonify({'success': False, 'message': 'Faltan datos requeridos'}), 400
         
         # Validar que haya al menos una foto
-        if not fotos_base64 or len(fotos_base64) == 0:
+        if not fotos or len(fotos) == 0:
             return jsonify({'success': False, 'message': 'Debes capturar al menos una foto'}), 400
         
-        conn = sqlite3.connect('registro.db')
-        c = conn.cursor()
+        # Rechazar fotos en base64 demasiado grandes antes de decodificar ninguna
+        if any(isinstance(foto, str) and len(foto) > MAX_FOTO_BASE64 for foto in fotos):
+            return jsonify({'success': False, 'message': 'Una de las fotos es demasiado grande'}), 400
         
         # Si hay registro_id, es una actualización (retomar fotos)
         if registro_id:
             # Buscar la carpeta existente del residente
-            c.execute('SELECT carpeta_path FROM residentes WHERE id = ?', (registro_id,))
+            c = get_db().cursor()
+            c.execute(SQL_SELECT_CARPETA_RESIDENTE, (registro_id,))
             result = c.fetchone()
             if result:
                 carpeta_persona = result[0]
             else:
-                conn.close()
                 return jsonify({'success': False, 'message': 'Registro no encontrado'}), 404
         else:
             # Crear nueva subcarpeta para el residente
@@ -248,56 +709,54 @@ def registrar_residente():
             carpeta_persona = os.path.join(app.config['UPLOAD_FOLDER'], nombre_carpeta)
             os.makedirs(carpeta_persona, exist_ok=True)
         
-        # Guardar todas las fotos en la subcarpeta
-        foto_paths = []
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        
-        for i, foto_base64 in enumerate(fotos_base64):
-            # Decodificar la imagen base64 (eliminar el prefijo data:image/jpeg;base64,)
-            foto_data = base64.b64decode(foto_base64.split(',')[1])
-            foto_filename = f"foto_{i+1:02d}.jpg"
-            foto_path = os.path.join(carpeta_persona, foto_filename)
-            
-            # Guardar la foto en el sistema de archivos
-            with open(foto_path, 'wb') as f:
-                f.write(foto_data)
-            
-            foto_paths.append(foto_path)
+        # Las fotos y datos.json se escriben fuera de la transacción, para no
+        # retener el lock de escritura de SQLite durante la escritura a disco
+        foto_paths = guardar_fotos(fotos, carpeta_persona)
         
         # Crear archivo de datos en JSON dentro de la carpeta
         datos_persona = {
             'nombre': nombre,
             'rut': rut,
             'tipo': 'residente',
-            'fecha_registro': datetime.now().isoformat(),
-            'total_fotos': len(fotos_base64)
+            'fecha_registro': datetime.now(),
+            'total_fotos': len(fotos)
         }
         
+        # orjson serializa los datetime en formato ISO 8601 y escribe UTF-8
         datos_path = os.path.join(carpeta_persona, 'datos.json')
-        with open(datos_path, 'w', encoding='utf-8') as f:
-            json.dump(datos_persona, f, indent=2, ensure_ascii=False)
+        with open(datos_path, 'wb') as f:
+            f.write(orjson.dumps(datos_persona, option=orjson.OPT_INDENT_2))
         
-        # Guardar o actualizar en la base de datos
         try:
-            if registro_id:
-                # Actualizar registro existente con nueva foto principal
-                c.execute('''UPDATE residentes SET foto_path = ? WHERE id = ?''', 
-                         (foto_paths[0], registro_id))
-                conn.commit()
-                mensaje = f'Fotos actualizadas exitosamente con {len(fotos_base64)} foto(s)'
-            else:
-                # Insertar nuevo registro en la base de datos
-                c.execute('''INSERT INTO residentes (nombre, rut, foto_path, carpeta_path)
-                             VALUES (?, ?, ?, ?)''', (nombre, rut, foto_paths[0], carpeta_persona))
-                conn.commit()
-                mensaje = f'Residente registrado exitosamente con {len(fotos_base64)} foto(s)'
-            
-            return jsonify({'success': True, 'message': mensaje})
+            # Transacción IMMEDIATE corta (en la conexión de escritura) solo para
+            # guardar el registro; confirma al terminar o revierte si ocurre un error
+            with get_db_escritura() as conn:
+                c = conn.cursor()
+                
+                # Guardar o actualizar en la base de datos
+                if registro_id:
+                    # Actualizar registro existente con nueva foto principal
+                    c.execute(SQL_UPDATE_FOTO_RESIDENTE, (foto_paths[0], registro_id))
+                    if c.rowcount == 0:
+                        # El registro se eliminó mientras se guardaban las fotos
+                        return jsonify({'success': False, 'message': 'Registro no encontrado'}), 404
+                    id_guardado = registro_id
+                    mensaje = f'Fotos actualizadas exitosamente con {len(fotos)} foto(s)'
+                else:
+                    # Insertar nuevo registro en la base de datos
+                    c.execute(SQL_INSERT_RESIDENTE, (nombre, rut, foto_paths[0], carpeta_persona))
+                    id_guardado = c.lastrowid
+                    mensaje = f'Residente registrado exitosamente con {len(fotos)} foto(s)'
         except sqlite3.IntegrityError:
             # El RUT ya está registrado (solo aplica para nuevos registros)
             return jsonify({'success': False, 'message': 'El RUT ya está registrado'}), 400
-        finally:
-            conn.close()
+        
+        # Generar la miniatura y publicar solo después de confirmar la transacción:
+        # si se revierte, el ID podría reutilizarse y mostrar la foto de otra persona
+        generar_miniatura('residente', id_guardado, foto_paths[0])
+        publicar_foto('residente', id_guardado, foto_paths[0])
+        
+        return jsonify({'success': True, 'message': mensaje})
             
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
@@ -319,10 +778,10 @@ def registrar_visita():
     5. Crea archivo datos.json con información incluyendo fecha de expiración
     6. Guarda o actualiza el registro en la base de datos
     
-    Body JSON esperado:
+    Body esperado (multipart/form-data, o JSON con fotos en base64):
         nombre (str): Nombre de la visita
         rut (str): RUT de la visita (sin puntos ni guión)
-        fotos (list): Lista de fotos en formato base64
+        fotos (list): Archivos JPEG (multipart) o lista de fotos en base64 (JSON)
         fecha_limite (str): Fecha y hora límite en formato 'YYYY-MM-DDTHH:MM'
         registro_id (str, opcional): ID del registro si se está actualizando
         
@@ -336,10 +795,9 @@ def registrar_visita():
         500: Error del servidor
     """
     try:
-        data = request.json
+        data, fotos = obtener_datos_registro()
         nombre = data.get('nombre')
         rut = data.get('rut')
-        fotos_base64 = data.get('fotos', [])
         fecha_limite_str = data.get('fecha_limite', '')
         registro_id = data.get('registro_id')
         
@@ -347,9 +805,13 @@ def registrar_visita():
         if not nombre or not rut:
             return jsonify({'success': False, 'message': 'Faltan datos requeridos'}), 400
         
-        if not fotos_base64 or len(fotos_base64) == 0:
+        if not fotos or len(fotos) == 0:
             return jsonify({'success': False, 'message': 'Debes capturar al menos una foto'}), 400
         
+        # Rechazar fotos en base64 demasiado grandes antes de decodificar ninguna
+        if any(isinstance(foto, str) and len(foto) > MAX_FOTO_BASE64 for foto in fotos):
+            return jsonify({'success': False, 'message': 'Una de las fotos es demasiado grande'}), 400
+        
         if not fecha_limite_str:
             return jsonify({'success': False, 'message': 'Debes especificar una fecha y hora límite'}), 400
         
@@ -360,18 +822,15 @@ def registrar_visita():
         except ValueError:
             return jsonify({'success': False, 'message': 'Formato de fecha inválido'}), 400
         
-        conn = sqlite3.connect('registro.db')
-        c = conn.cursor()
-        
         # Si hay registro_id, es una actualización (retomar fotos)
         if registro_id:
             # Buscar la carpeta existente de la visita
-            c.execute('SELECT carpeta_path FROM visitas WHERE id = ?', (registro_id,))
+            c = get_db().cursor()
+            c.execute(SQL_SELECT_CARPETA_VISITA, (registro_id,))
             result = c.fetchone()
             if result:
                 carpeta_persona = result[0]
             else:
-                conn.close()
                 return jsonify({'success': False, 'message': 'Registro no encontrado'}), 404
         else:
             # Crear nueva subcarpeta para la visita
@@ -379,95 +838,117 @@ def registrar_visita():
             carpeta_persona = os.path.join(app.config['UPLOAD_FOLDER'], nombre_carpeta)
             os.makedirs(carpeta_persona, exist_ok=True)
         
-        # Guardar todas las fotos en la subcarpeta
-        foto_paths = []
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        
-        for i, foto_base64 in enumerate(fotos_base64):
-            # Decodificar imagen base64
-            foto_data = base64.b64decode(foto_base64.split(',')[1])
-            foto_filename = f"foto_{i+1:02d}.jpg"
-            foto_path = os.path.join(carpeta_persona, foto_filename)
-            
-            # Guardar foto en el sistema de archivos
-            with open(foto_path, 'wb') as f:
-                f.write(foto_data)
-            
-            foto_paths.append(foto_path)
+        # Las fotos y datos.json se escriben fuera de la transacción, para no
+        # retener el lock de escritura de SQLite durante la escritura a disco
+        foto_paths = guardar_fotos(fotos, carpeta_persona)
         
         # Crear archivo de datos en JSON con información de la visita
         datos_persona = {
             'nombre': nombre,
             'rut': rut,
             'tipo': 'visita',
-            'fecha_registro': datetime.now().isoformat(),
-            'fecha_expiracion': fecha_expiracion.isoformat(),
-            'total_fotos': len(fotos_base64)
+            'fecha_registro': datetime.now(),
+            'fecha_expiracion': fecha_expiracion,
+            'total_fotos': len(fotos)
         }
         
+        # orjson serializa los datetime en formato ISO 8601 y escribe UTF-8
         datos_path = os.path.join(carpeta_persona, 'datos.json')
-        with open(datos_path, 'w', encoding='utf-8') as f:
-            json.dump(datos_persona, f, indent=2, ensure_ascii=False)
+        with open(datos_path, 'wb') as f:
+            f.write(orjson.dumps(datos_persona, option=orjson.OPT_INDENT_2))
         
-        # Guardar o actualizar en la base de datos
-        if registro_id:
-            # Actualizar registro existente con nueva foto y fecha de expiración
-            c.execute('''UPDATE visitas SET foto_path = ?, fecha_expiracion = ? WHERE id = ?''', 
-                     (foto_paths[0], fecha_expiracion, registro_id))
-            conn.commit()
-            fecha_formateada = fecha_expiracion.strftime('%d/%m/%Y %H:%M')
-            mensaje = f'Fotos actualizadas exitosamente con {len(fotos_base64)} foto(s). Válida hasta {fecha_formateada}'
-        else:
-            # Insertar nuevo registro de visita
-            c.execute('''INSERT INTO visitas (nombre, rut, foto_path, carpeta_path, fecha_expiracion)
-                         VALUES (?, ?, ?, ?, ?)''', (nombre, rut, foto_paths[0], carpeta_persona, fecha_expiracion))
-            conn.commit()
-            fecha_formateada = fecha_expiracion.strftime('%d/%m/%Y %H:%M')
-            mensaje = f'Visita registrada exitosamente con {len(fotos_base64)} foto(s). Válida hasta {fecha_formateada}'
+        # Transacción IMMEDIATE corta (en la conexión de escritura) solo para
+        # guardar el registro; confirma al terminar o revierte si ocurre un error
+        with get_db_escritura() as conn:
+            c = conn.cursor()
+            
+            # Guardar o actualizar en la base de datos
+            if registro_id:
+                # Actualizar registro existente con nueva foto y fecha de expiración
+                c.execute(SQL_UPDATE_FOTO_VISITA, (foto_paths[0], fecha_expiracion, registro_id))
+                if c.rowcount == 0:
+                    # El registro se eliminó mientras se guardaban las fotos
+                    return jsonify({'success': False, 'message': 'Registro no encontrado'}), 404
+                id_guardado = registro_id
+                fecha_formateada = fecha_expiracion.strftime('%d/%m/%Y %H:%M')
+                mensaje = f'Fotos actualizadas exitosamente con {len(fotos)} foto(s). Válida hasta {fecha_formateada}'
+            else:
+                # Insertar nuevo registro de visita
+                c.execute(SQL_INSERT_VISITA, (nombre, rut, foto_paths[0], carpeta_persona, fecha_expiracion))
+                id_guardado = c.lastrowid
+                fecha_formateada = fecha_expiracion.strftime('%d/%m/%Y %H:%M')
+                mensaje = f'Visita registrada exitosamente con {len(fotos)} foto(s). Válida hasta {fecha_formateada}'
+        
+        # Generar la miniatura y publicar solo después de confirmar la transacción:
+        # si se revierte, el ID podría reutilizarse y mostrar la foto de otra persona
+        generar_miniatura('visita', id_guardado, foto_paths[0])
+        publicar_foto('visita', id_guardado, foto_paths[0])
         
-        conn.close()
         return jsonify({'success': True, 'message': mensaje})
         
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
 @app.route('/foto/<int:registro_id>/<tipo>')
-def servir_foto(registro_id, tipo):
+def servir_foto(registro_id, tipo, miniatura=None):
     """
     Sirve la foto principal de un registro como imagen HTTP.
     
     Esta función permite mostrar las fotos de residentes y visitas en la
     página de listado. Busca la ruta de la foto principal en la base de
-    datos y la sirve como archivo JPEG.
+    datos y la sirve como archivo JPEG. Con el parámetro ?size=thumb se
+    sirve la miniatura (si existe) en lugar de la foto original, en formato
+    WebP si el navegador lo acepta.
     
     Args:
         registro_id (int): ID del registro (residente o visita)
         tipo (str): Tipo de registro ('residente' o 'visita')
+        miniatura (bool, opcional): Servir la miniatura; si es None se usa
+                                    el parámetro GET size=thumb
         
     Returns:
-        File: Archivo de imagen JPEG o error 404 si no se encuentra
+        File: Archivo de imagen JPEG/WebP o error 404 si no se encuentra
         
     Status codes:
         200: Foto encontrada y servida exitosamente
         404: Registro no encontrado o archivo de foto no existe
     """
     try:
-        conn = sqlite3.connect('registro.db')
+        conn = get_db()
         c = conn.cursor()
         
         # Buscar la ruta de la foto según el tipo de registro
         if tipo == 'residente':
-            c.execute('SELECT foto_path FROM residentes WHERE id = ?', (registro_id,))
+            c.execute(SQL_SELECT_FOTO_RESIDENTE, (registro_id,))
         else:
-            c.execute('SELECT foto_path FROM visitas WHERE id = ?', (registro_id,))
+            c.execute(SQL_SELECT_FOTO_VISITA, (registro_id,))
+        # Cualquier tipo distinto de 'residente' se busca como visita
+        tipo_registro = 'residente' if tipo == 'residente' else 'visita'
         
         result = c.fetchone()
-        conn.close()
+        foto_path = result[0] if result else None
+        
+        # Usar la miniatura si se pidió y existe (los registros antiguos no la tienen)
+        if miniatura is None:
+            miniatura = request.args.get('size') == 'thumb'
+        mimetype = 'image/jpeg'
+        if foto_path and miniatura:
+            if acepta_webp() and os.path.exists(ruta_miniatura_webp(tipo_registro, registro_id)):
+                foto_path = ruta_miniatura_webp(tipo_registro, registro_id)
+                mimetype = 'image/webp'
+            elif os.path.exists(ruta_miniatura(tipo_registro, registro_id)):
+                foto_path = ruta_miniatura(tipo_registro, registro_id)
         
         # Verificar que existe el registro y el archivo de foto
-        if result and result[0] and os.path.exists(result[0]):
-            # Servir el archivo de imagen
-            return send_file(result[0], mimetype='image/jpeg')
+        if foto_path and os.path.exists(foto_path):
+            # Servir el archivo de imagen con ETag y Last-Modified para que el
+            # navegador pueda revalidar y recibir un 304 sin volver a descargarla
+            response = send_file(foto_path, mimetype=mimetype, conditional=True, etag=True,
+                                 last_modified=os.path.getmtime(foto_path))
+            if miniatura:
+                # La misma URL entrega JPEG o WebP según la cabecera Accept
+                response.vary.add('Accept')
+            return response
         else:
             # Retornar error 404 si no se encuentra
             abort(404)
@@ -475,70 +956,87 @@ def servir_foto(registro_id, tipo):
         # En caso de cualquier error, retornar 404
         abort(404)
 
+@app.route('/fotos/<tipo>/<int:registro_id>.jpg')
+def servir_foto_publica(tipo, registro_id):
+    """
+    Sirve la copia pública de la foto principal de un registro.
+    
+    En producción el proxy inverso sirve /fotos/ directamente desde
+    FOTOS_PUBLICAS_FOLDER y solo deriva a esta ruta si el archivo no existe.
+    En desarrollo, o para registros sin copia pública, se usa servir_foto
+    con la miniatura de la foto principal.
+    
+    Args:
+        tipo (str): Tipo de registro ('residente' o 'visita')
+        registro_id (int): ID del registro
+        
+    Returns:
+        File: Archivo de imagen JPEG o error 404 si no se encuentra
+    """
+    if app.config['FOTOS_PUBLICAS_FOLDER'] and tipo in ('residente', 'visita'):
+        foto_publica = ruta_foto_publica(tipo, registro_id)
+        if os.path.exists(foto_publica):
+            return send_file(foto_publica, mimetype='image/jpeg', conditional=True, etag=True,
+                             last_modified=os.path.getmtime(foto_publica))
+    return servir_foto(registro_id, tipo, miniatura=True)
+
+@app.after_request
+def cabeceras_cache_fotos(response):
+    """
+    Agrega las cabeceras de caché a las respuestas de las rutas de fotos.
+    
+    Las fotos se pueden cachear en el navegador y en proxies, pero deben
+    revalidarse en cada uso: al retomar fotos se reutilizan los mismos nombres
+    de archivo (foto_01.jpg, ...), por lo que no se pueden marcar como inmutables.
+    La revalidación usa el ETag/Last-Modified y normalmente termina en un 304.
+    
+    Args:
+        response (Response): Respuesta generada por la ruta
+        
+    Returns:
+        Response: La misma respuesta con las cabeceras de caché ajustadas
+    """
+    if request.endpoint in ('servir_foto', 'servir_foto_publica') and response.status_code in (200, 304):
+        response.headers['Cache-Control'] = 'public, no-cache'
+    return response
+
 @app.route('/listar_registros')
 def listar_registros():
     """
     Muestra la página con todos los registros de residentes y visitas.
     
     Esta función obtiene todos los residentes registrados y todas las visitas
-    que aún no han expirado (fecha_expiracion > fecha actual). Los datos se
-    formatean en diccionarios para facilitar su uso en el template.
+    que aún no han expirado (fecha_expiracion > fecha actual). Las filas se
+    obtienen como sqlite3.Row, accesibles por nombre de columna en el template.
     
     Las visitas expiradas no se muestran en esta lista, pero pueden eliminarse
     manualmente o usando el endpoint limpiar_visitas_expiradas.
     
     Returns:
         HTML: Renderiza el template listar_registros.html con las listas de
-              residentes y visitas formateadas
+              residentes y visitas
         
     Status codes:
         200: Lista generada exitosamente
         500: Error al acceder a la base de datos
     """
     try:
-        conn = sqlite3.connect('registro.db')
+        conn = get_db()
         c = conn.cursor()
         
         # Obtener todos los residentes ordenados por fecha de registro (más recientes primero)
-        c.execute('''SELECT id, nombre, rut, foto_path, carpeta_path, fecha_registro 
-                     FROM residentes ORDER BY fecha_registro DESC''')
+        c.execute(SQL_LISTAR_RESIDENTES)
         residentes = c.fetchall()
         
         # Obtener solo las visitas que aún no han expirado
-        c.execute('''SELECT id, nombre, rut, foto_path, carpeta_path, fecha_registro, fecha_expiracion 
-                     FROM visitas WHERE fecha_expiracion > ? ORDER BY fecha_registro DESC''', (datetime.now(),))
+        c.execute(SQL_LISTAR_VISITAS)
         visitas = c.fetchall()
         
-        conn.close()
-        
-        # Formatear datos de residentes en diccionarios para el template
-        residentes_list = []
-        for r in residentes:
-            residentes_list.append({
-                'id': r[0],
-                'nombre': r[1],
-                'rut': r[2],
-                'foto_path': r[3],
-                'carpeta_path': r[4],
-                'fecha_registro': r[5]
-            })
-        
-        # Formatear datos de visitas en diccionarios para el template
-        visitas_list = []
-        for v in visitas:
-            visitas_list.append({
-                'id': v[0],
-                'nombre': v[1],
-                'rut': v[2],
-                'foto_path': v[3],
-                'carpeta_path': v[4],
-                'fecha_registro': v[5],
-                'fecha_expiracion': v[6]
-            })
-        
+        # Las filas (sqlite3.Row) se pasan directamente al template, que accede
+        # a sus columnas por nombre (residente.nombre, visita.fecha_expiracion, ...)
         return render_template('listar_registros.html', 
-                             residentes=residentes_list, 
-                             visitas=visitas_list)
+                             residentes=residentes, 
+                             visitas=visitas)
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
@@ -594,14 +1092,14 @@ def eliminar_registro(tipo, registro_id):
         500: Error al eliminar el registro
     """
     try:
-        conn = sqlite3.connect('registro.db')
+        conn = get_db()
         c = conn.cursor()
         
         # Obtener la ruta de la carpeta del registro según su tipo
         if tipo == 'residente':
-            c.execute('SELECT carpeta_path FROM residentes WHERE id = ?', (registro_id,))
+            c.execute(SQL_SELECT_CARPETA_RESIDENTE, (registro_id,))
         elif tipo == 'visita':
-            c.execute('SELECT carpeta_path FROM visitas WHERE id = ?', (registro_id,))
+            c.execute(SQL_SELECT_CARPETA_VISITA, (registro_id,))
         else:
             return jsonify({'success': False, 'message': 'Tipo inválido'}), 400
         
@@ -620,14 +1118,16 @@ def eliminar_registro(tipo, registro_id):
                 print(f"Error al eliminar carpeta {carpeta_path}: {e}")
         
         # Eliminar registro de la base de datos
-        if tipo == 'residente':
-            c.execute('DELETE FROM residentes WHERE id = ?', (registro_id,))
-        else:
-            c.execute('DELETE FROM visitas WHERE id = ?', (registro_id,))
-        
-        conn.commit()
-        conn.close()
+        with get_db_escritura() as conn_escritura:
+            if tipo == 'residente':
+                conn_escritura.execute(SQL_DELETE_RESIDENTE, (registro_id,))
+            else:
+                conn_escritura.execute(SQL_DELETE_VISITA, (registro_id,))
         
+        # Eliminar la copia pública y la miniatura de la foto principal
+        eliminar_foto_publica(tipo, registro_id)
+        eliminar_miniatura(tipo, registro_id)
+
         return jsonify({'success': True, 'message': f'{tipo.capitalize()} eliminado exitosamente'})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
@@ -662,14 +1162,14 @@ def retomar_fotos(tipo, registro_id):
         500: Error al procesar la solicitud
     """
     try:
-        conn = sqlite3.connect('registro.db')
+        conn = get_db()
         c = conn.cursor()
         
         # Obtener información del registro según su tipo
         if tipo == 'residente':
-            c.execute('SELECT nombre, rut, carpeta_path FROM residentes WHERE id = ?', (registro_id,))
+            c.execute(SQL_SELECT_RETOMAR_RESIDENTE, (registro_id,))
         elif tipo == 'visita':
-            c.execute('SELECT nombre, rut, fecha_expiracion, carpeta_path FROM visitas WHERE id = ?', (registro_id,))
+            c.execute(SQL_SELECT_RETOMAR_VISITA, (registro_id,))
         else:
             return jsonify({'success': False, 'message': 'Tipo inválido'}), 400
         
@@ -684,14 +1184,21 @@ def retomar_fotos(tipo, registro_id):
         
         # Eliminar solo las fotos anteriores (mantener carpeta y datos.json)
         if carpeta_path and os.path.exists(carpeta_path):
-            for archivo in os.listdir(carpeta_path):
-                # Eliminar solo archivos que empiecen con 'foto_' y terminen en '.jpg'
-                if archivo.startswith('foto_') and archivo.endswith('.jpg'):
-                    try:
-                        os.remove(os.path.join(carpeta_path, archivo))
-                    except Exception as e:
-                        print(f"Error al eliminar foto {archivo}: {e}")
-        
+            with os.scandir(carpeta_path) as entradas:
+                for entrada in entradas:
+                    archivo = entrada.name
+                    # Eliminar solo archivos que empiecen con 'foto_' y terminen en '.jpg'
+                    if archivo.startswith('foto_') and archivo.endswith('.jpg'):
+                        try:
+                            os.unlink(entrada.path)
+                        except Exception as e:
+                            print(f"Error al eliminar foto {archivo}: {e}")
+
+        # La copia pública y la miniatura también dejan de estar disponibles
+        # hasta capturar nuevas fotos
+        eliminar_foto_publica(tipo, registro_id)
+        eliminar_miniatura(tipo, registro_id)
+
         # Construir parámetros para la redirección a la página de captura
         params = {
             'tipo': tipo,
@@ -709,9 +1216,8 @@ def retomar_fotos(tipo, registro_id):
             fecha_formato = fecha_expiracion.strftime('%Y-%m-%dT%H:%M')
             params['fecha_limite'] = fecha_formato
         
-        # Construir query string y redirigir
-        query_string = '&'.join([f"{k}={v}" for k, v in params.items()])
-        return redirect(f'/captura_fotos?{query_string}')
+        # url_for codifica los parámetros (nombres con espacios, '&', tildes, etc.)
+        return redirect(url_for('captura_fotos', **params))
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 